@@ -1,31 +1,100 @@
 import argparse
+from collections import OrderedDict
 from datetime import datetime
+import itertools
 import json
 import os
 import random
-import re
+import shutil
 import sys
+import tempfile
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from functools import wraps
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from functools import lru_cache, wraps
+from io import BytesIO
 from queue import Queue, Empty
 from threading import Lock
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from colorama import Fore, Style, init
 from mutagen.id3 import ID3, APIC, TIT2, TPE1, error
 from mutagen.mp3 import MP3
 
+try:
+    import orjson  # Optional, much faster parsing of large feed pages
+except ImportError:
+    orjson = None
+
 init(autoreset=True)
 
-FILENAME_BAD_CHARS = r'[<>:"/\\|?*\x00-\x1F]'
+FILENAME_BAD_CHARS = '<>:"/\\|?*' + "".join(map(chr, range(0x20)))
+_FILENAME_TRANSLATION = dict.fromkeys(map(ord, FILENAME_BAD_CHARS), "_")
 STATE_FILE = "suno_download_state.json"
+POOL_SIZE = 32  # Minimum pooled connections per host, raised to fit --max-workers
+MAX_RETRIES = 10
+FEED_RETRIES = 4  # urllib3 retries per feed page request, worst case about 7 s of backoff
+FEED_DEADLINE = 3 * 60  # No feed body re-read starts after this many seconds
+# (connect, read) timeouts: fail fast on dead hosts, but let slow transfers keep
+# going as long as bytes keep arriving
+FEED_TIMEOUT = (5, 60)
+COVER_TIMEOUT = (5, 60)
+DOWNLOAD_TIMEOUT = (5, 300)
+DOWNLOAD_DEADLINE = 15 * 60  # Total seconds one song may spend retrying
+COVER_DEADLINE = 2 * 60
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB buffered copies from the socket
+STATE_SAVE_INTERVAL = 10  # Downloads between state file flushes
+RANGED_MIN_SIZE = 32 * 1024 * 1024  # Files at least this big are split into ranges
+SPOOL_MAX_SIZE = 32 * 1024 * 1024  # Streamed downloads are buffered in memory up to this size
+RANGED_SEGMENTS = 4  # Parallel connections per ranged download
+COVER_CACHE_SIZE = 64  # Covers kept in memory, neighbouring songs often share one
 
 # Global lock for thread-safe file operations and printing
 state_lock = Lock()
 print_lock = Lock()
 
+# Cover downloads by (url, proxies, token, timeout), least recently used first (guarded by cover_lock).
+# Holding futures lets concurrent callers share a single in-flight request.
+cover_lock = Lock()
+_cover_futures = OrderedDict()
+
+# Last state written per state file path, to skip rewriting unchanged state (guarded by state_lock)
+_saved_states = {}
+
+# Shared HTTP session so every request reuses pooled keep-alive connections
+# instead of paying a fresh TCP+TLS handshake (requests.Session is safe for concurrent GETs).
+# Connection errors, timeouts and 429/5xx responses are retried by urllib3 with
+# exponential backoff, honouring Retry-After.
+SESSION = requests.Session()
+_retry = Retry(
+    total=MAX_RETRIES,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["GET"],
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+# Feed pages get fewer retries, so one bad page fails in seconds rather than minutes
+FEED_URL_PREFIX = "https://studio-api.prod.suno.com/api/feed/"
+_feed_retry = _retry.new(total=FEED_RETRIES)
+
+def configure_session(pool_size):
+    """Mount SESSION's adapters with room for pool_size concurrent connections per host."""
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=pool_size, max_retries=_retry)
+    SESSION.mount("http://", adapter)
+    SESSION.mount("https://", adapter)
+    # requests picks the longest matching prefix, so feed pages use this one
+    SESSION.mount(FEED_URL_PREFIX, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=_feed_retry))
+
+configure_session(POOL_SIZE)
+
+# Page probes treat any error as "no content", so they must fail fast and are never retried
+PROBE_SESSION = requests.Session()
+PROBE_SESSION.mount("http://", HTTPAdapter(max_retries=0))
+PROBE_SESSION.mount("https://", HTTPAdapter(max_retries=0))
+
 def log_with_timestamp(message, color=Fore.WHITE):
     """Thread-safe logging with timestamp."""
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -51,137 +120,260 @@ def prompt_for_new_token():
         return None
 
 def sanitize_filename(name, maxlen=200):
-    safe = re.sub(FILENAME_BAD_CHARS, "_", name)
+    safe = name.translate(_FILENAME_TRANSLATION)
     safe = safe.strip(" .")
     return safe[:maxlen] if len(safe) > maxlen else safe
 
-def retry_with_backoff(max_retries=10, initial_delay=1, backoff_factor=2):
-    """Decorator to retry a function with exponential backoff."""
+def backoff(attempt, base=0.5, cap=30, factor=2):
+    """Exponential backoff delay (seconds) for a 0-based attempt, capped and jittered."""
+    return min(cap, base * factor ** attempt) * (0.5 + random.random())
+
+def retry_after_delay(exc):
+    """Return the Retry-After delay (seconds) sent with an HTTP 429 error, or None."""
+    response = getattr(exc, "response", None)
+    if response is None or response.status_code != 429:
+        return None
+    try:
+        return max(0.0, float(response.headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return None
+
+def retry_with_backoff(max_retries=10, initial_delay=1, backoff_factor=2, deadline=None):
+    """
+    Decorator to retry a function with jittered exponential backoff.
+    deadline: optional total time budget in seconds; no retry starts after it runs out.
+    """
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            delay = initial_delay
             last_exception = None
+            give_up_at = time.monotonic() + deadline if deadline is not None else None
             for attempt in range(max_retries):
                 try:
                     return func(*args, **kwargs)
                 except Exception as e:
                     last_exception = e
                     if attempt < max_retries - 1:
+                        delay = retry_after_delay(e)
+                        if delay is None:
+                            delay = backoff(attempt, initial_delay, factor=backoff_factor)
+                        if give_up_at is not None and time.monotonic() + delay > give_up_at:
+                            print(f"{Fore.RED}  -> Attempt {attempt + 1} failed: {e}")
+                            print(f"{Fore.RED}  -> Giving up, {deadline} second retry budget used up")
+                            break
                         print(f"{Fore.YELLOW}  -> Attempt {attempt + 1} failed: {e}")
-                        print(f"{Fore.YELLOW}  -> Retrying in {delay} seconds...")
+                        print(f"{Fore.YELLOW}  -> Retrying in {delay:.1f} seconds...")
                         time.sleep(delay)
-                        delay *= backoff_factor
                     else:
                         print(f"{Fore.RED}  -> All {max_retries} attempts failed")
             raise last_exception
         return wrapper
     return decorator
 
+def json_loads(data):
+    """Parse JSON bytes, using orjson when it is installed."""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def json_dumps(obj):
+    """Serialize to indented UTF-8 JSON bytes, using orjson when it is installed."""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
 def load_state(directory):
     """Load the download state from JSON file."""
     state_path = os.path.join(directory, STATE_FILE)
     if os.path.exists(state_path):
         try:
-            with open(state_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(state_path, 'rb') as f:
+                return json_loads(f.read())
         except Exception as e:
             print(f"{Fore.YELLOW}Warning: Could not load state file: {e}")
             return {}
     return {}
 
 def save_state(directory, state):
-    """Save the download state to JSON file."""
+    """
+    Save the download state to JSON file.
+    Written to a temp file and swapped in with os.replace, so a crash never leaves
+    a truncated state file. Skipped if the state hasn't changed since the last save.
+    """
     state_path = os.path.join(directory, STATE_FILE)
     with state_lock:
+        if _saved_states.get(state_path) == state and os.path.exists(state_path):
+            return
         try:
-            with open(state_path, 'w', encoding='utf-8') as f:
-                json.dump(state, f, indent=2, ensure_ascii=False)
+            tmp_path = state_path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(json_dumps(state))
+            os.replace(tmp_path, state_path)
+            _saved_states[state_path] = dict(state)
         except Exception as e:
             print(f"{Fore.RED}Warning: Could not save state file: {e}")
 
+def split_downloaded(songs, state):
+    """Split songs into (pending_songs, skipped_count) using the saved download state."""
+    pending = [song for song in songs if not (song["uuid"] in state and os.path.exists(state[song["uuid"]]))]
+    return pending, len(songs) - len(pending)
+
 def pick_proxy_dict(proxies_list):
     if not proxies_list: return None
-    proxy = random.choice(proxies_list)
+    proxy = proxies_list[0] if len(proxies_list) == 1 else random.choice(proxies_list)
+    return _proxy_dict(proxy)
+
+@lru_cache(maxsize=None)
+def _proxy_dict(proxy):
+    # Shared between requests. requests may setdefault() environment proxies into it,
+    # which can never override the explicit http/https entries.
     return {"http": proxy, "https": proxy}
 
-@retry_with_backoff(max_retries=10, initial_delay=2, backoff_factor=2)
-def embed_metadata(mp3_path, image_url=None, title=None, artist=None, proxies_list=None, token=None, timeout=15):
+def fetch_cover(image_url, proxies_list=None, token=None, timeout=COVER_TIMEOUT):
+    """
+    Download cover art, cached by URL. Returns (mime, image_bytes).
+    Concurrent callers for the same cover wait on one request; failures are not cached.
+    """
+    proxies = tuple(proxies_list) if proxies_list else None
+    key = (image_url, proxies, token, timeout)
+    with cover_lock:
+        future = _cover_futures.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = Future()
+            _cover_futures[key] = future
+            while len(_cover_futures) > COVER_CACHE_SIZE:
+                _cover_futures.popitem(last=False)
+        else:
+            _cover_futures.move_to_end(key)
+    
+    if is_owner:
+        try:
+            future.set_result(_download_cover(image_url, proxies, token, timeout))
+        except Exception as e:
+            with cover_lock:
+                if _cover_futures.get(key) is future:
+                    del _cover_futures[key]
+            future.set_exception(e)
+    return future.result()
+
+@retry_with_backoff(max_retries=3, initial_delay=2, backoff_factor=2, deadline=COVER_DEADLINE)
+def _download_cover(image_url, proxies, token, timeout):
     headers = {"Authorization": f"Bearer {token}"} if token else {}
-    proxy_dict = pick_proxy_dict(proxies_list)
-    r = requests.get(image_url, proxies=proxy_dict, headers=headers, timeout=timeout)
+    r = SESSION.get(image_url, proxies=pick_proxy_dict(proxies), headers=headers, timeout=timeout)
     r.raise_for_status()
-    image_bytes = r.content
-    mime = r.headers.get("Content-Type", "image/jpeg").split(";")[0]
-    
-    audio = MP3(mp3_path, ID3=ID3)
-    try: audio.add_tags()
-    except error: pass
+    return r.headers.get("Content-Type", "image/jpeg").split(";")[0], r.content
 
-    if title: audio.tags["TIT2"] = TIT2(encoding=3, text=title)
-    if artist: audio.tags["TPE1"] = TPE1(encoding=3, text=artist)
+def build_tag_frames(title=None, artist=None, cover=None):
+    """Build the ID3 frames to embed. cover is a (mime, image_bytes) tuple."""
+    frames = []
+    if title: frames.append(TIT2(encoding=3, text=title))
+    if artist: frames.append(TPE1(encoding=3, text=artist))
+    if cover:
+        mime, image_bytes = cover
+        frames.append(APIC(encoding=3, mime=mime, type=3, desc="Cover", data=image_bytes))
+    return frames
 
-    for key in list(audio.tags.keys()):
-        if key.startswith("APIC"): del audio.tags[key]
+def apply_tag_frames(tags, frames):
+    """Replace every frame of the same type (e.g. all APIC:* covers) with the given frames."""
+    for frame in frames:
+        tags.delall(frame.FrameID)
+        tags.add(frame)
 
-    audio.tags.add(APIC(encoding=3, mime=mime, type=3, desc="Cover", data=image_bytes))
-    audio.save(v2_version=3)
+def read_leading_id3(stream):
+    """
+    Consume an ID3v2 tag from the start of an audio stream.
+    Returns (tags, leftover) where leftover is audio data read past the tag.
+    """
+    header = stream.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return ID3(), header
+    # Tag size is a 28-bit synchsafe integer, plus a 10 byte footer if flagged
+    size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+    if header[5] & 0x10:
+        size += 10
+    tag_data = header + stream.read(size)
+    try:
+        return ID3(BytesIO(tag_data), load_v1=False), b""
+    except error:
+        return ID3(), b""  # Unreadable tag, replace it with ours
 
 def check_page_exists(page_num, token_string, proxies_list=None):
-    """Quickly check if a page has content (returns True if page has clips)."""
+    """
+    Quickly check if a page has content.
+    Returns the page payload (truthy) if the page has clips, False if empty, None on auth error.
+    """
     base_api_url = "https://studio-api.prod.suno.com/api/feed/v2?hide_disliked=true&hide_gen_stems=true&hide_studio_clips=true&page="
     headers = {"Authorization": f"Bearer {token_string}"}
     api_url = f"{base_api_url}{page_num}"
     
     try:
-        response = requests.get(api_url, headers=headers, proxies=pick_proxy_dict(proxies_list), timeout=10)
+        response = PROBE_SESSION.get(api_url, headers=headers, proxies=pick_proxy_dict(proxies_list), timeout=FEED_TIMEOUT)
         if response.status_code in [401, 403]:
             return None  # Auth error
         if response.status_code == 404 or response.status_code >= 500:
             return False  # No content or error
         response.raise_for_status()
-        data = response.json()
+        data = json_loads(response.content)
         clips = data if isinstance(data, list) else data.get("clips", [])
-        return len(clips) > 0
-    except requests.exceptions.RequestException:
+        return data if len(clips) > 0 else False
+    except (requests.exceptions.RequestException, ValueError):
         return False
 
-def fetch_page_with_retry(page_num, token_container, proxies_list=None, max_retries=10):
-    """Fetch a single page with retry logic. Returns the page data or raises exception."""
+def total_pages_hint(data):
+    """Estimate the number of pages from pagination fields in a feed payload, or None."""
+    if not isinstance(data, dict):
+        return None
+    for key in ("num_pages", "total_pages"):
+        value = data.get(key)
+        if isinstance(value, int) and value > 0:
+            return value
+    page_size = data.get("page_size") or len(data.get("clips") or [])
+    for key in ("num_total_results", "total_clips", "total"):
+        value = data.get(key)
+        if isinstance(value, int) and value > 0 and page_size:
+            return -(-value // page_size)  # ceil division
+    return None
+
+def fetch_page_with_retry(page_num, token_container, proxies_list=None):
+    """Fetch a single page with retry logic. Returns the page clips or raises exception."""
     base_api_url = "https://studio-api.prod.suno.com/api/feed/v2?hide_disliked=true&hide_gen_stems=true&hide_studio_clips=true&page="
     api_url = f"{base_api_url}{page_num}"
     
-    delay = 2
-    last_exception = None
+    # Get current token from container
+    current_token = token_container[0] if isinstance(token_container, list) else token_container
+    headers = {"Authorization": f"Bearer {current_token}"}
     
-    for attempt in range(max_retries):
+    auth_status, clips = _get_feed_clips(api_url, headers, proxies_list)
+    if auth_status:
+        raise Exception(f"Authorization failed (status {auth_status})")
+    return clips
+
+def _get_feed_clips(api_url, headers, proxies_list):
+    """
+    GET and parse a feed page. Failed connections and 429/5xx replies are retried by
+    SESSION's feed adapter (FEED_RETRIES); a body that breaks off mid-read or doesn't
+    parse is re-read once, unless FEED_DEADLINE has already passed.
+    Returns (auth_status, clips); auth_status is set on 401/403, which isn't retried.
+    """
+    give_up_at = time.monotonic() + FEED_DEADLINE
+    for attempt in range(2):
+        # Streamed, so urllib3's retries end once headers arrive and body errors surface below
+        response = SESSION.get(api_url, headers=headers, proxies=pick_proxy_dict(proxies_list), timeout=FEED_TIMEOUT, stream=True)
         try:
-            # Get current token from container
-            current_token = token_container[0] if isinstance(token_container, list) else token_container
-            headers = {"Authorization": f"Bearer {current_token}"}
-            
-            response = requests.get(api_url, headers=headers, proxies=pick_proxy_dict(proxies_list), timeout=15)
-            
             if response.status_code in [401, 403]:
-                raise Exception(f"Authorization failed (status {response.status_code})")
+                return response.status_code, None
             
             response.raise_for_status()
-            data = response.json()
-            clips = data if isinstance(data, list) else data.get("clips", [])
-            
-            return clips
-            
-        except Exception as e:
-            last_exception = e
-            if attempt < max_retries - 1:
-                log_with_timestamp(f"    -> Page {page_num} attempt {attempt + 1} failed: {e}", Fore.YELLOW)
-                log_with_timestamp(f"    -> Retrying in {delay} seconds...", Fore.YELLOW)
-                time.sleep(delay)
-                delay *= 2
-            else:
-                log_with_timestamp(f"    -> Page {page_num} failed after {max_retries} attempts", Fore.RED)
-    
-    raise last_exception
+            try:
+                data = json_loads(response.content)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                if attempt or time.monotonic() > give_up_at:
+                    raise
+                print(f"{Fore.YELLOW}  -> Feed page body failed: {e}")
+                print(f"{Fore.YELLOW}  -> Re-reading it once...")
+                continue
+        finally:
+            response.close()
+        return None, data if isinstance(data, list) else data.get("clips", [])
 
 def download_all_pages_parallel(last_page, token_string, proxies_list=None, token_container=None, max_workers=5):
     """
@@ -201,7 +393,7 @@ def download_all_pages_parallel(last_page, token_string, proxies_list=None, toke
             
             # Try to fetch with current token, handle auth errors specially
             try:
-                clips = fetch_page_with_retry(page_num, token_container or [token_string], proxies_list, max_retries=10)
+                clips = fetch_page_with_retry(page_num, token_container or [token_string], proxies_list)
             except Exception as e:
                 if "Authorization failed" in str(e):
                     log_with_timestamp(f"  ⚠️  Page {page_num} failed: Authorization error", Fore.RED)
@@ -214,7 +406,7 @@ def download_all_pages_parallel(last_page, token_string, proxies_list=None, toke
                                 token_container[0] = new_token
                                 log_with_timestamp(f"  🔄 Retrying page {page_num} with new token...", Fore.CYAN)
                                 # Retry with new token
-                                clips = fetch_page_with_retry(page_num, token_container, proxies_list, max_retries=10)
+                                clips = fetch_page_with_retry(page_num, token_container, proxies_list)
                             else:
                                 raise Exception("No new token provided")
                         else:
@@ -224,28 +416,19 @@ def download_all_pages_parallel(last_page, token_string, proxies_list=None, toke
             
             log_with_timestamp(f"  ✅ Page {page_num}/{last_page} downloaded ({len(clips)} clips)", Fore.GREEN)
             
-            # Process clips into song data
-            page_songs = []
-            for clip in clips:
-                uuid = clip.get("id")
-                title = clip.get("title")
-                audio_url = clip.get("audio_url")
-                image_url = clip.get("image_url")
-                created_at = clip.get("created_at", "")
-                
-                if uuid and title and audio_url:
-                    song_data = {
-                        "uuid": uuid,
-                        "title": title,
-                        "audio_url": audio_url,
-                        "image_url": image_url,
-                        "display_name": clip.get("display_name"),
-                        "created_at": created_at
-                    }
-                    page_songs.append(song_data)
-            
-            # Reverse songs within page (API returns newest first within each page)
-            page_songs.reverse()
+            # Process clips into song data, reversed within the page (API returns newest first)
+            page_songs = [
+                {
+                    "uuid": clip["id"],
+                    "title": clip["title"],
+                    "audio_url": clip["audio_url"],
+                    "image_url": clip.get("image_url"),
+                    "display_name": clip.get("display_name"),
+                    "created_at": clip.get("created_at", "")
+                }
+                for clip in reversed(clips)
+                if clip.get("id") and clip.get("title") and clip.get("audio_url")
+            ]
             
             with pages_lock:
                 pages_data[page_num] = page_songs
@@ -270,11 +453,10 @@ def download_all_pages_parallel(last_page, token_string, proxies_list=None, toke
                 log_with_timestamp(f"❌ Failed to download page {page_num}: {e}", Fore.RED)
                 raise Exception(f"Page download failed for page {page_num}. Cannot continue.")
     
-    # Combine all pages in order (from last to first)
-    all_songs = []
-    for page_num in range(last_page, 0, -1):
-        if page_num in pages_data:
-            all_songs.extend(pages_data[page_num])
+    # Combine all pages in order (from last to first). A song that shifted pages while
+    # the feed was being fetched would appear twice, so keep one entry per UUID.
+    ordered_pages = (pages_data.get(page_num, []) for page_num in range(last_page, 0, -1))
+    all_songs = list({song["uuid"]: song for song in itertools.chain.from_iterable(ordered_pages)}.values())
     
     log_with_timestamp(f"✅ All {last_page} pages downloaded successfully! Total songs: {len(all_songs)}", Fore.GREEN)
     return all_songs
@@ -284,26 +466,39 @@ def find_last_page(token_string, proxies_list=None):
     log_with_timestamp("🔍 Finding last page using binary search...", Fore.CYAN)
     
     # First check if page 1 exists
-    exists = check_page_exists(1, token_string, proxies_list)
-    if exists is None:
+    first_page = check_page_exists(1, token_string, proxies_list)
+    if first_page is None:
         log_with_timestamp("Authorization failed. Token may be expired.", Fore.RED)
         return 0
-    if not exists:
+    if not first_page:
         log_with_timestamp("No songs found on page 1", Fore.RED)
         return 0
     
-    # Binary search to find the last page
-    # First, find an upper bound by exponentially increasing
+    # If the feed reports its size, start the search from there
     low = 1
     high = 2
+    search_upward = True
+    hint = total_pages_hint(first_page)
+    if hint and hint > 1:
+        log_with_timestamp(f"🔎 Feed reports about {hint} pages, verifying...", Fore.CYAN)
+        if check_page_exists(hint, token_string, proxies_list):
+            low = hint
+            high = hint + 1
+        else:
+            high = hint  # Overshot, the last page is below the hint
+            search_upward = False
     
-    log_with_timestamp(f"🔎 Searching for upper bound... checking page {high}", Fore.CYAN)
-    while check_page_exists(high, token_string, proxies_list):
-        low = high
-        high *= 2
-        log_with_timestamp(f"🔎 Page {low} exists, trying page {high}...", Fore.CYAN)
-        time.sleep(0.1)  # Small delay to avoid rate limiting
+    # Binary search to find the last page
+    # First, find an upper bound by exponentially increasing
+    if search_upward:
+        log_with_timestamp(f"🔎 Searching for upper bound... checking page {high}", Fore.CYAN)
+        while check_page_exists(high, token_string, proxies_list):
+            low = high
+            high *= 2
+            log_with_timestamp(f"🔎 Page {low} exists, trying page {high}...", Fore.CYAN)
     
+    # Page `high` is known to be empty
+    high -= 1
     log_with_timestamp(f"🔎 Upper bound found between page {low} and {high}, binary searching...", Fore.CYAN)
     
     # Now binary search between low and high
@@ -315,7 +510,6 @@ def find_last_page(token_string, proxies_list=None):
             low = mid
         else:
             high = mid - 1
-        time.sleep(0.1)  # Small delay to avoid rate limiting
     
     log_with_timestamp(f"✅ Found last page: {low}", Fore.GREEN)
     return low
@@ -351,31 +545,158 @@ def extract_private_song_info(token_string, proxies_list=None, song_queue=None,
     log_with_timestamp(f"Total songs found: {len(all_songs)}", Fore.GREEN)
     return all_songs
 
-def get_next_version_filename(base_filename, existing_files):
+def get_next_version_filename(base_filename, existing_files, counters=None):
     """
     Get the next available version filename based on existing files.
     Uses existing_files set for O(1) lookup instead of filesystem checks.
+    counters: optional dict remembering the next version to try per base filename,
+    so repeated titles don't re-probe every earlier version.
     """
     if base_filename not in existing_files:
         return base_filename, 1
     
     name, extn = os.path.splitext(base_filename)
-    counter = 2
+    counter = counters.get(base_filename, 2) if counters is not None else 2
     while True:
         new_filename = f"{name} v{counter}{extn}"
         if new_filename not in existing_files:
+            if counters is not None:
+                counters[base_filename] = counter + 1
             return new_filename, counter
         counter += 1
 
-@retry_with_backoff(max_retries=10, initial_delay=2, backoff_factor=2)
-def download_file(url, filename, proxies_list=None, token=None, timeout=30):
-    """Download a file with retry logic."""
-    headers = {"Authorization": f"Bearer {token}"} if token else {}
-    with requests.get(url, stream=True, proxies=pick_proxy_dict(proxies_list), headers=headers, timeout=timeout) as r:
+def write_stream(r, filename, tag_frames=None):
+    """
+    Write a streamed response body to filename.
+    tag_frames: optional callable returning ID3 frames; they are merged into the
+    stream's own tag and written in the same pass as the audio.
+    The body is buffered in memory (spilling to a temp file past SPOOL_MAX_SIZE) and,
+    once complete, copied to a temp file next to filename that is then swapped in with
+    os.replace, so a failed download or copy leaves no partial file.
+    """
+    r.raw.decode_content = True
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+        if tag_frames is not None:
+            tags, leftover = read_leading_id3(r.raw)
+            apply_tag_frames(tags, tag_frames())
+            tags.update_to_v23()
+            tags.save(spool, v2_version=3)
+            spool.seek(0, os.SEEK_END)
+            spool.write(leftover)
+        shutil.copyfileobj(r.raw, spool, length=DOWNLOAD_CHUNK_SIZE)
+        size = spool.tell()
+        spool.seek(0)
+        part_path = filename + ".part"
+        try:
+            with open(part_path, "wb") as f:
+                if size and hasattr(os, "posix_fallocate"):
+                    try:
+                        os.posix_fallocate(f.fileno(), 0, size)
+                    except OSError:
+                        pass  # Not supported by every filesystem
+                shutil.copyfileobj(spool, f, length=DOWNLOAD_CHUNK_SIZE)
+            os.replace(part_path, filename)
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+
+def copy_to_offset(stream, filename, offset, length):
+    """Copy exactly length bytes from stream into filename starting at offset."""
+    with open(filename, "r+b") as f:
+        f.seek(offset)
+        remaining = length
+        while remaining:
+            chunk = stream.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise IOError(f"Connection closed with {remaining} bytes of the range left")
+            f.write(chunk)
+            remaining -= len(chunk)
+
+def supports_ranges(r):
+    """Whether a response is a large, uncompressed body the server can serve in ranges."""
+    size = int(r.headers.get("Content-Length") or 0)
+    return (size >= RANGED_MIN_SIZE
+            and r.headers.get("Accept-Ranges") == "bytes"
+            and r.headers.get("Content-Encoding", "identity") == "identity")
+
+def download_ranges(r, url, filename, headers, proxy_dict, timeout, tag_frames=None):
+    """
+    Download a large file over several connections, one byte range each.
+    The first range is read from the already open response r.
+    Ranges are written to a temp file next to filename, which only replaces filename
+    once every range (and the tag, if tag_frames is given) was written.
+    Returns False if the server ignored the Range header.
+    """
+    size = int(r.headers["Content-Length"])
+    segment = -(-size // RANGED_SEGMENTS)
+    ranges = [(start, min(start + segment, size)) for start in range(0, size, segment)]
+    part_path = filename + ".part"
+    
+    def fetch_range(start, end):
+        range_headers = dict(headers, Range=f"bytes={start}-{end - 1}")
+        with SESSION.get(url, stream=True, proxies=proxy_dict, headers=range_headers, timeout=timeout) as part:
+            part.raise_for_status()
+            if part.status_code != 206:
+                return False
+            copy_to_offset(part.raw, part_path, start, end - start)
+            return True
+    
+    try:
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+        
+        with ThreadPoolExecutor(max_workers=len(ranges) - 1) as executor:
+            futures = [executor.submit(fetch_range, start, end) for start, end in ranges[1:]]
+            first_start, first_end = ranges[0]
+            copy_to_offset(r.raw, part_path, first_start, first_end - first_start)
+            if not all([future.result() for future in futures]):
+                os.remove(part_path)
+                return False
+        
+        if tag_frames is not None:
+            embed_tag_frames(part_path, tag_frames())
+        os.replace(part_path, filename)
+        return True
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+def embed_tag_frames(mp3_path, frames):
+    """Embed ID3 frames into an MP3 file that is already on disk."""
+    audio = MP3(mp3_path, ID3=ID3)
+    try: audio.add_tags()
+    except error: pass
+    apply_tag_frames(audio.tags, frames)
+    audio.tags.update_to_v23()
+    audio.save(v2_version=3)
+
+@retry_with_backoff(max_retries=3, initial_delay=2, backoff_factor=2, deadline=DOWNLOAD_DEADLINE)
+def download_file(url, filename, proxies_list=None, token=None, timeout=DOWNLOAD_TIMEOUT, tag_frames=None):
+    """
+    Download a file with retry logic.
+    Large files on servers that accept Range requests are fetched in parallel ranges.
+    tag_frames: optional callable returning ID3 frames to embed.
+    """
+    # MP3 is already compressed; asking for the raw bytes keeps Content-Length
+    # equal to the bytes written, which the ranged path relies on
+    headers = {"Accept-Encoding": "identity"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    proxy_dict = pick_proxy_dict(proxies_list)
+    with SESSION.get(url, stream=True, proxies=proxy_dict, headers=headers, timeout=timeout) as r:
+        r.raise_for_status()
+        if not supports_ranges(r):
+            write_stream(r, filename, tag_frames)
+            return filename
+        if download_ranges(r, url, filename, headers, proxy_dict, timeout, tag_frames):
+            return filename
+    
+    # The server answered a range with the full body, start over as a single stream
+    with SESSION.get(url, stream=True, proxies=proxy_dict, headers=headers, timeout=timeout) as r:
         r.raise_for_status()
-        with open(filename, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk: f.write(chunk)
+        write_stream(r, filename, tag_frames)
     return filename
 
 def create_placeholder_file(filename, error_message):
@@ -407,9 +728,25 @@ def set_file_timestamp(filepath, created_at_str):
         # Silently fail if timestamp parsing fails
         pass
 
-def process_song(song_data, args, state, existing_files, proxies_list):
+def assign_filenames(songs, directory, existing_files, counters=None):
+    """
+    Reserve a versioned target path for every song, in list order (oldest first).
+    counters: optional per-run dict passed to get_next_version_filename (guarded by state_lock).
+    Returns a list of (path, version) matching songs.
+    """
+    targets = []
+    with state_lock:
+        for song_data in songs:
+            fname = sanitize_filename(song_data["title"] or song_data["uuid"]) + ".mp3"
+            final_filename, version = get_next_version_filename(fname, existing_files, counters)
+            existing_files.add(final_filename)
+            targets.append((os.path.join(directory, final_filename), version))
+    return targets
+
+def process_song(song_data, args, state, existing_files, proxies_list, target=None):
     """
     Process a single song download with retry logic and state management.
+    target: optional (path, version) reserved by assign_filenames; picked here if omitted.
     Returns (uuid, filename, success, error_message, was_skipped)
     """
     uuid = song_data["uuid"]
@@ -423,35 +760,42 @@ def process_song(song_data, args, state, existing_files, proxies_list):
     
     log_with_timestamp(f"🎵 Processing: {title} [UUID: {uuid}]", Fore.GREEN)
     
-    fname = sanitize_filename(title) + ".mp3"
-    base_path = os.path.join(args.directory, fname)
-    
     # Get the next available filename
-    with state_lock:
-        final_filename, version = get_next_version_filename(fname, existing_files)
-        final_path = os.path.join(args.directory, final_filename)
-        existing_files.add(final_filename)
+    if target is None:
+        target = assign_filenames([song_data], args.directory, existing_files)[0]
+    final_path, version = target
+    
+    cover_pool = None
+    tag_frames = None
+    if args.with_thumbnail and song_data.get("image_url"):
+        # Fetch the cover while the audio request is in flight, tags are written with the audio
+        log_with_timestamp(f"  🖼️  Fetching thumbnail: {title} [UUID: {uuid}]", Fore.WHITE)
+        cover_pool = ThreadPoolExecutor(max_workers=1)
+        cover_future = cover_pool.submit(fetch_cover, song_data["image_url"], proxies_list, args.token)
+        
+        def tag_frames():
+            # A missing thumbnail must never fail (or re-download) the audio itself
+            try:
+                cover = cover_future.result()
+            except Exception as e:
+                log_with_timestamp(f"  ⚠️  Thumbnail failed, saving without it: {title} [UUID: {uuid}] - {e}", Fore.YELLOW)
+                cover = None
+            return build_tag_frames(title, song_data.get("display_name"), cover)
     
     try:
         log_with_timestamp(f"  ⬇️  Downloading: {title} [UUID: {uuid}]", Fore.WHITE)
-        saved_path = download_file(
-            song_data["audio_url"], 
-            final_path, 
-            proxies_list=proxies_list,
-            token=args.token,
-            timeout=30
-        )
-        
-        if args.with_thumbnail and song_data.get("image_url"):
-            log_with_timestamp(f"  🖼️  Embedding thumbnail: {title} [UUID: {uuid}]", Fore.WHITE)
-            embed_metadata(
-                saved_path, 
-                image_url=song_data["image_url"], 
-                token=args.token, 
-                artist=song_data.get("display_name"), 
-                title=title,
-                proxies_list=proxies_list
+        try:
+            saved_path = download_file(
+                song_data["audio_url"], 
+                final_path, 
+                proxies_list=proxies_list,
+                token=args.token,
+                timeout=DOWNLOAD_TIMEOUT,
+                tag_frames=tag_frames
             )
+        finally:
+            if cover_pool:
+                cover_pool.shutdown(wait=False)
         
         # Set file timestamp to match Suno's created_at
         if song_data.get("created_at"):
@@ -483,7 +827,7 @@ def main():
     parser.add_argument("--directory", type=str, default="suno-downloads", help="Local directory for saving files.")
     parser.add_argument("--with-thumbnail", action="store_true", default=True, help="Embed the song's thumbnail (default: True)")
     parser.add_argument("--no-thumbnail", dest="with_thumbnail", action="store_false", help="Disable thumbnail embedding")
-    parser.add_argument("--max-workers", type=int, default=10, help="Number of parallel downloads (default: 10)")
+    parser.add_argument("--max-workers", "--concurrency", dest="max_workers", type=int, default=10, help="Number of parallel downloads (default: 10)")
     parser.add_argument("--resume", action="store_true", default=True, help="Skip already downloaded songs (default: True)")
     parser.add_argument("--no-resume", dest="resume", action="store_false", help="Disable resume functionality")
     args = parser.parse_args()
@@ -494,6 +838,9 @@ def main():
     log_with_timestamp("=" * 60, Fore.CYAN)
     log_with_timestamp(f"Settings: Workers={args.max_workers}, Resume={args.resume}, Thumbnails={args.with_thumbnail}", Fore.CYAN)
 
+    # Each worker can hold RANGED_SEGMENTS audio connections and a cover connection at once
+    configure_session(max(POOL_SIZE, (RANGED_SEGMENTS + 1) * args.max_workers))
+
     # Create directory if it doesn't exist
     if not os.path.exists(args.directory):
         os.makedirs(args.directory)
@@ -503,16 +850,53 @@ def main():
     log_with_timestamp(f"Loaded state: {len(state)} songs previously downloaded", Fore.CYAN)
     
     # Get existing files in directory for version tracking
-    existing_files = set()
-    for fname in os.listdir(args.directory):
-        if fname.endswith('.mp3') or fname.endswith('_FAILED.txt'):
-            existing_files.add(fname)
+    with os.scandir(args.directory) as entries:
+        existing_files = {
+            entry.name for entry in entries
+            if entry.name.endswith(('.mp3', '_FAILED.txt')) and entry.is_file()
+        }
+    # Next version number to try per base filename, for this run's existing_files
+    version_counters = {}
     
-    proxies_list = args.proxy.split(",") if args.proxy else None
+    # Parsed once; a tuple so fetch_cover can use it as a cache key without copying
+    proxies_list = tuple(args.proxy.split(",")) if args.proxy else None
     
     # Token container that can be updated when token expires
     token_container = [args.token]
     
+    try:
+        downloaded_count, skipped_count, failed_count = download_songs(args, state, existing_files, version_counters, proxies_list, token_container)
+    except KeyboardInterrupt:
+        save_state(args.directory, state)
+        log_with_timestamp("⏹️  Interrupted, progress saved. Run again to resume.", Fore.YELLOW)
+        sys.exit(130)
+    
+    # Final state save
+    save_state(args.directory, state)
+    
+    end_time = datetime.now()
+    duration = end_time - start_time
+    
+    log_with_timestamp("=" * 60, Fore.CYAN)
+    log_with_timestamp("🎵 DOWNLOAD COMPLETE 🎵", Fore.GREEN)
+    log_with_timestamp("=" * 60, Fore.CYAN)
+    log_with_timestamp(f"✅ Successfully downloaded: {downloaded_count}", Fore.GREEN)
+    log_with_timestamp(f"⏭️  Skipped (already downloaded): {skipped_count}", Fore.CYAN)
+    if failed_count > 0:
+        log_with_timestamp(f"❌ Failed: {failed_count}", Fore.RED)
+    log_with_timestamp(f"⏱️  Total time: {duration}", Fore.CYAN)
+    log_with_timestamp(f"📁 Files are in '{args.directory}'", Fore.CYAN)
+    
+    log_with_timestamp("=" * 60, Fore.CYAN)
+    
+    sys.exit(0)
+
+def download_songs(args, state, existing_files, version_counters, proxies_list, token_container):
+    """
+    Extract the song list and download everything not yet in state.
+    Updates state in place, flushing it every STATE_SAVE_INTERVAL downloads.
+    Returns (downloaded_count, skipped_count, failed_count).
+    """
     # Use parallel processing if max_workers > 1, otherwise use queue-based approach
     if args.max_workers > 1:
         log_with_timestamp(f"Using parallel downloads with {args.max_workers} workers", Fore.CYAN)
@@ -550,79 +934,81 @@ def main():
             log_with_timestamp("No songs found. Please check your token.", Fore.RED)
             sys.exit(1)
         
+        songs = []
+        while True:
+            try:
+                songs.append(song_queue.get_nowait())
+            except Empty:
+                break
+        
+        # Drop already downloaded songs before they reach the pool
+        skipped_count = 0
+        if args.resume:
+            songs, skipped_count = split_downloaded(songs, state)
+            if skipped_count:
+                log_with_timestamp(f"⏭️  Skipping {skipped_count} songs already downloaded", Fore.CYAN)
+        
         log_with_timestamp(f"🚀 Starting parallel song downloads ({args.max_workers} workers)...", Fore.CYAN)
         
-        # Process songs as they come in
         downloaded_count = 0
         failed_count = 0
-        skipped_count = 0
         last_progress_time = time.time()
         
         with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
-            futures = []
+            # All pages were already downloaded, so every song can be submitted up front;
+            # the executor itself caps how many run at once.
+            # Filenames are picked up front in chronological order, so version numbers
+            # don't depend on which download happens to finish first
+            targets = assign_filenames(songs, args.directory, existing_files, version_counters)
+            futures = [
+                executor.submit(process_song, song_data, args, state, existing_files, proxies_list, target)
+                for song_data, target in zip(songs, targets)
+            ]
             
-            # Now process all songs from the queue (all pages were already downloaded)
-            while not song_queue.empty():
-                # Submit new tasks as songs become available
-                while len(futures) < args.max_workers and not song_queue.empty():
+            # Collect results in the main thread as they complete
+            try:
+                for future in as_completed(futures):
                     try:
-                        song_data = song_queue.get_nowait()
-                        future = executor.submit(process_song, song_data, args, state, existing_files, proxies_list)
-                        futures.append(future)
-                    except Empty:
-                        break
-                
-                # Check completed tasks
-                if futures:
-                    done_futures = [f for f in futures if f.done()]
-                    for future in done_futures:
-                        try:
-                            uuid, filename, success, error, was_skipped = future.result()
-                            if success and filename:
-                                state[uuid] = filename
-                                if was_skipped:
-                                    skipped_count += 1
-                                else:
-                                    downloaded_count += 1
+                        uuid, filename, success, error, was_skipped = future.result()
+                        if success and filename:
+                            state[uuid] = filename
+                            if was_skipped:
+                                skipped_count += 1
+                            else:
+                                downloaded_count += 1
                                 # Save state periodically
-                                if (downloaded_count + skipped_count) % 10 == 0:
+                                if downloaded_count % STATE_SAVE_INTERVAL == 0:
                                     save_state(args.directory, state)
-                            else:
-                                failed_count += 1
-                        except Exception as e:
-                            log_with_timestamp(f"Unexpected error: {e}", Fore.RED)
+                        else:
                             failed_count += 1
-                        futures.remove(future)
-                
-                # Progress update every 30 seconds
-                if time.time() - last_progress_time > 30:
-                    total = downloaded_count + failed_count + skipped_count
-                    if total > 0:
+                    except Exception as e:
+                        log_with_timestamp(f"Unexpected error: {e}", Fore.RED)
+                        failed_count += 1
+                    
+                    # Progress update every 30 seconds
+                    if time.time() - last_progress_time > 30:
+                        total = downloaded_count + failed_count + skipped_count
                         progress = (total / total_songs[0]) * 100
                         log_with_timestamp(
                             f"📊 Progress: {total}/{total_songs[0]} ({progress:.1f}%) | "
                             f"✅ {downloaded_count} | ⏭️ {skipped_count} | ❌ {failed_count}",
                             Fore.CYAN
                         )
-                    last_progress_time = time.time()
+                        last_progress_time = time.time()
+            except KeyboardInterrupt:
+                # Don't start queued songs, only wait for the ones in flight
+                for future in futures:
+                    future.cancel()
+                executor.shutdown(wait=True)
                 
-                time.sleep(0.1)
-            
-            # Wait for remaining futures
-            for future in futures:
-                try:
-                    uuid, filename, success, error, was_skipped = future.result()
-                    if success and filename:
-                        state[uuid] = filename
-                        if was_skipped:
-                            skipped_count += 1
-                        else:
-                            downloaded_count += 1
-                    else:
-                        failed_count += 1
-                except Exception as e:
-                    log_with_timestamp(f"Unexpected error: {e}", Fore.RED)
-                    failed_count += 1
+                # Record songs that finished while shutting down, so the saved
+                # state doesn't make the next run download them again as a new version
+                for future in futures:
+                    if future.done() and not future.cancelled() and future.exception() is None:
+                        uuid, filename, success, error, was_skipped = future.result()
+                        if success and filename:
+                            state[uuid] = filename
+                raise
         
     else:
         # Sequential processing (original behavior but improved)
@@ -632,14 +1018,20 @@ def main():
             log_with_timestamp("No songs found. Please check your token.", Fore.RED)
             sys.exit(1)
         
+        skipped_count = 0
+        if args.resume:
+            songs, skipped_count = split_downloaded(songs, state)
+            if skipped_count:
+                log_with_timestamp(f"⏭️  Skipping {skipped_count} songs already downloaded", Fore.CYAN)
+        
         log_with_timestamp(f"Starting Download Process ({len(songs)} songs to process)", Fore.CYAN)
         
         downloaded_count = 0
         failed_count = 0
-        skipped_count = 0
         
-        for i, song_data in enumerate(songs, 1):
-            uuid, filename, success, error, was_skipped = process_song(song_data, args, state, existing_files, proxies_list)
+        targets = assign_filenames(songs, args.directory, existing_files, version_counters)
+        for i, (song_data, target) in enumerate(zip(songs, targets), 1):
+            uuid, filename, success, error, was_skipped = process_song(song_data, args, state, existing_files, proxies_list, target)
             
             if success and filename:
                 state[uuid] = filename
@@ -647,9 +1039,9 @@ def main():
                     skipped_count += 1
                 else:
                     downloaded_count += 1
-                # Save state periodically
-                if (downloaded_count + skipped_count) % 10 == 0:
-                    save_state(args.directory, state)
+                    # Save state periodically
+                    if downloaded_count % STATE_SAVE_INTERVAL == 0:
+                        save_state(args.directory, state)
                     
                 # Progress update
                 if i % 10 == 0:
@@ -662,25 +1054,7 @@ def main():
             else:
                 failed_count += 1
     
-    # Final state save
-    save_state(args.directory, state)
-    
-    end_time = datetime.now()
-    duration = end_time - start_time
-    
-    log_with_timestamp("=" * 60, Fore.CYAN)
-    log_with_timestamp("🎵 DOWNLOAD COMPLETE 🎵", Fore.GREEN)
-    log_with_timestamp("=" * 60, Fore.CYAN)
-    log_with_timestamp(f"✅ Successfully downloaded: {downloaded_count}", Fore.GREEN)
-    log_with_timestamp(f"⏭️  Skipped (already downloaded): {skipped_count}", Fore.CYAN)
-    if failed_count > 0:
-        log_with_timestamp(f"❌ Failed: {failed_count}", Fore.RED)
-    log_with_timestamp(f"⏱️  Total time: {duration}", Fore.CYAN)
-    log_with_timestamp(f"📁 Files are in '{args.directory}'", Fore.CYAN)
-    
-    log_with_timestamp("=" * 60, Fore.CYAN)
-    
-    sys.exit(0)
+    return downloaded_count, skipped_count, failed_count
 
 
 if __name__ == "__main__":
@@ -6,10 +6,15 @@ Tests retry logic, state management, and file versioning.
 
 import json
 import os
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
 import sys
 import tempfile
 import shutil
 from unittest.mock import Mock, patch, MagicMock
+from mutagen.id3 import TDRC
 import time
 
 # Import the module
@@ -17,6 +22,51 @@ sys.path.insert(0, os.path.dirname(__file__))
 import Suno_downloader as sd
 
 
+AUDIO = bytes(range(256)) * 40 + b"end"
+
+
+class AudioHandler(BaseHTTPRequestHandler):
+    """
+    Serves AUDIO, honouring Range requests. The path picks a failure mode:
+    /ignore answers ranges with the full body, /fail cuts range replies short,
+    /truncated cuts every reply short.
+    """
+    def log_message(self, *args):
+        pass
+    
+    def do_GET(self):
+        requested = self.headers.get("Range")
+        self.server.ranges.append(requested)
+        body = AUDIO
+        if requested and self.path != "/ignore":
+            start, end = map(int, requested[len("bytes="):].split("-"))
+            body = AUDIO[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(AUDIO)}")
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.path == "/truncated" or (self.path == "/fail" and requested):
+            body = body[:len(body) // 2]
+        self.wfile.write(body)
+
+
+@contextmanager
+def audio_server():
+    """Run AudioHandler on a free local port, yielding (base_url, server)."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), AudioHandler)
+    server.ranges = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}", server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
 def test_sanitize_filename():
     """Test filename sanitization."""
     print("Testing sanitize_filename...")
@@ -57,9 +107,50 @@ def test_get_next_version_filename():
     assert filename == "test v3.mp3"
     assert version == 3
     
+    # Counters resume from the last handed out version
+    counters = {}
+    taken = set(["song.mp3", "song v2.mp3"])
+    filename, version = sd.get_next_version_filename("song.mp3", taken, counters)
+    assert (filename, version) == ("song v3.mp3", 3)
+    taken.add(filename)
+    assert counters["song.mp3"] == 4
+    filename, version = sd.get_next_version_filename("song.mp3", taken, counters)
+    assert (filename, version) == ("song v4.mp3", 4)
+    
     print("✓ get_next_version_filename tests passed")
 
 
+def test_assign_filenames():
+    """Test that target filenames are reserved in song order."""
+    print("Testing assign_filenames...")
+    
+    existing_files = set(["Assigned.mp3"])
+    songs = [
+        {"uuid": "a", "title": "Assigned"},
+        {"uuid": "b", "title": "Fresh"},
+        {"uuid": "c", "title": "Assigned"},
+        {"uuid": "d", "title": None}
+    ]
+    
+    counters = {}
+    targets = sd.assign_filenames(songs, "out", existing_files, counters)
+    
+    assert targets == [
+        (os.path.join("out", "Assigned v2.mp3"), 2),
+        (os.path.join("out", "Fresh.mp3"), 1),
+        (os.path.join("out", "Assigned v3.mp3"), 3),
+        (os.path.join("out", "d.mp3"), 1)
+    ]
+    assert "Assigned v3.mp3" in existing_files
+    assert counters == {"Assigned.mp3": 4}
+    
+    # A fresh run starts from its own counters
+    targets = sd.assign_filenames([{"uuid": "e", "title": "Assigned"}], "other", set(["Assigned.mp3"]), {})
+    assert targets == [(os.path.join("other", "Assigned v2.mp3"), 2)]
+    
+    print("✓ assign_filenames tests passed")
+
+
 def test_state_management():
     """Test state file load/save."""
     print("Testing state management...")
@@ -81,6 +172,18 @@ def test_state_management():
         loaded_state = sd.load_state(tmpdir)
         assert loaded_state == test_state
         
+        # Writes go through a temp file that is swapped in
+        assert not os.path.exists(state_file + ".tmp")
+        
+        # Unchanged state is not rewritten
+        os.utime(state_file, (0, 0))
+        sd.save_state(tmpdir, test_state)
+        assert os.path.getmtime(state_file) == 0
+        
+        test_state["uuid3"] = "/path/to/file3.mp3"
+        sd.save_state(tmpdir, test_state)
+        assert sd.load_state(tmpdir) == test_state
+        
         # Test loading from non-existent directory
         empty_state = sd.load_state("/nonexistent/path")
         assert empty_state == {}
@@ -117,9 +220,333 @@ def test_retry_decorator():
     except Exception as e:
         assert str(e) == "Always fails"
     
+    # No retry starts once the deadline would be exceeded
+    attempts = [0]
+    
+    @sd.retry_with_backoff(max_retries=5, initial_delay=1, backoff_factor=2, deadline=0.1)
+    def slow_failure():
+        attempts[0] += 1
+        raise Exception("Still failing")
+    
+    try:
+        slow_failure()
+        assert False, "Should have raised exception"
+    except Exception as e:
+        assert str(e) == "Still failing"
+    assert attempts[0] == 1
+    
     print("✓ retry decorator tests passed")
 
 
+def test_backoff():
+    """Test jittered exponential backoff and Retry-After handling."""
+    print("Testing backoff...")
+    
+    # Jitter keeps each delay within 50%-150% of the exponential step
+    for attempt in range(4):
+        delay = sd.backoff(attempt, base=1)
+        assert 0.5 * 2 ** attempt <= delay <= 1.5 * 2 ** attempt
+    
+    # Large attempts are capped
+    assert sd.backoff(20, base=1, cap=30) <= 45
+    
+    # Retry-After is honoured only for 429 responses
+    error = Exception("Too many requests")
+    error.response = Mock(status_code=429, headers={"Retry-After": "7"})
+    assert sd.retry_after_delay(error) == 7.0
+    
+    error.response = Mock(status_code=503, headers={"Retry-After": "7"})
+    assert sd.retry_after_delay(error) is None
+    assert sd.retry_after_delay(Exception("no response")) is None
+    
+    print("✓ backoff tests passed")
+
+
+def test_total_pages_hint():
+    """Test page count estimation from feed pagination fields."""
+    print("Testing total_pages_hint...")
+    
+    clips = [{"id": str(i)} for i in range(20)]
+    assert sd.total_pages_hint({"clips": clips, "num_total_results": 41}) == 3
+    assert sd.total_pages_hint({"clips": clips, "num_pages": 5}) == 5
+    
+    # No usable fields means no hint
+    assert sd.total_pages_hint({"clips": clips}) is None
+    assert sd.total_pages_hint(clips) is None
+    
+    print("✓ total_pages_hint tests passed")
+
+
+def test_read_leading_id3():
+    """Test that a stream's own ID3 tag is split from the audio data."""
+    print("Testing read_leading_id3...")
+    
+    tags = sd.ID3()
+    tags.add(sd.TIT2(encoding=3, text="Original"))
+    tag_buffer = BytesIO()
+    tags.save(tag_buffer, v2_version=3)
+    audio = b"\xff\xfb" + b"\x00" * 100
+    
+    stream = BytesIO(tag_buffer.getvalue() + audio)
+    parsed, leftover = sd.read_leading_id3(stream)
+    assert str(parsed["TIT2"]) == "Original"
+    assert leftover + stream.read() == audio
+    
+    # Untagged streams hand back the bytes that were peeked
+    stream = BytesIO(audio)
+    parsed, leftover = sd.read_leading_id3(stream)
+    assert len(parsed) == 0
+    assert leftover + stream.read() == audio
+    
+    print("✓ read_leading_id3 tests passed")
+
+
+def test_tags_saved_as_v23():
+    """Test that v2.4-only frames from the source tag are converted when saving as v2.3."""
+    print("Testing ID3v2.3 conversion...")
+    
+    source = sd.ID3()
+    source.add(sd.TIT2(encoding=3, text="Original"))
+    source.add(TDRC(encoding=3, text="2024-05-01"))
+    tag_buffer = BytesIO()
+    source.save(tag_buffer, v2_version=4)
+    # A few silent 128 kbps MPEG frames, enough for mutagen to read the file as MP3
+    audio = (b"\xff\xfb\x90\x64" + b"\x00" * 413) * 8
+    
+    def check_v23(path):
+        saved = sd.ID3(path, translate=False)
+        assert saved.version == (2, 3, 0)
+        assert "TDRC" not in saved
+        assert str(saved["TYER"]) == "2024"
+        assert str(saved["TIT2"]) == "New"
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "Song.mp3")
+        response = Mock()
+        response.raw = BytesIO(tag_buffer.getvalue() + audio)
+        sd.write_stream(response, filename, lambda: sd.build_tag_frames("New"))
+        check_v23(filename)
+        
+        filename = os.path.join(tmpdir, "Tagged.mp3")
+        with open(filename, "wb") as f:
+            f.write(tag_buffer.getvalue() + audio)
+        sd.embed_tag_frames(filename, sd.build_tag_frames("New"))
+        check_v23(filename)
+    
+    print("✓ ID3v2.3 conversion tests passed")
+
+
+def test_fetch_cover_single_flight():
+    """Test that concurrent cover requests share one download and failures aren't cached."""
+    print("Testing fetch_cover single flight...")
+    
+    calls = [0]
+    release = threading.Event()
+    
+    def slow_download(image_url, proxies, token, timeout):
+        calls[0] += 1
+        release.wait(1)
+        return ("image/jpeg", b"cover")
+    
+    results = []
+    with patch.object(sd, "_download_cover", side_effect=slow_download):
+        threads = [
+            threading.Thread(target=lambda: results.append(sd.fetch_cover("http://example.com/shared.jpg")))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+    
+    assert calls[0] == 1
+    assert results == [("image/jpeg", b"cover")] * 5
+    
+    # A failed fetch is evicted so the next caller tries again
+    with patch.object(sd, "_download_cover", side_effect=Exception("404")):
+        try:
+            sd.fetch_cover("http://example.com/broken.jpg")
+            assert False, "Should have raised exception"
+        except Exception as e:
+            assert str(e) == "404"
+    with patch.object(sd, "_download_cover", return_value=("image/png", b"ok")):
+        assert sd.fetch_cover("http://example.com/broken.jpg") == ("image/png", b"ok")
+    
+    print("✓ fetch_cover single flight tests passed")
+
+
+def test_fetch_page_retries_body():
+    """Test that a truncated feed body is re-read once, and status errors are left to urllib3."""
+    print("Testing fetch_page_with_retry...")
+    
+    truncated = Mock(status_code=200, content=b'{"clips": [{"id"')
+    complete = Mock(status_code=200, content=b'{"clips": [{"id": "a"}]}')
+    with patch.object(sd.SESSION, "get", side_effect=[truncated, complete]) as get:
+        clips = sd.fetch_page_with_retry(1, ["token"])
+    assert clips == [{"id": "a"}]
+    assert get.call_count == 2
+    
+    # Only one re-read
+    with patch.object(sd.SESSION, "get", return_value=truncated) as get:
+        try:
+            sd.fetch_page_with_retry(1, ["token"])
+            assert False, "Should have raised exception"
+        except ValueError:
+            pass
+    assert get.call_count == 2
+    
+    # A 5xx that urllib3 already retried is not fetched again
+    unavailable = Mock(status_code=503)
+    unavailable.raise_for_status.side_effect = sd.requests.exceptions.HTTPError("503")
+    with patch.object(sd.SESSION, "get", return_value=unavailable) as get:
+        try:
+            sd.fetch_page_with_retry(1, ["token"])
+            assert False, "Should have raised exception"
+        except sd.requests.exceptions.HTTPError:
+            pass
+    assert get.call_count == 1
+    
+    # Feed pages use the bounded retry policy
+    adapter = sd.SESSION.get_adapter(sd.FEED_URL_PREFIX + "v2?page=1")
+    assert adapter.max_retries.total == sd.FEED_RETRIES
+    
+    with patch.object(sd.SESSION, "get", return_value=Mock(status_code=401)) as get:
+        try:
+            sd.fetch_page_with_retry(1, ["token"])
+            assert False, "Should have raised exception"
+        except Exception as e:
+            assert "Authorization failed" in str(e)
+    assert get.call_count == 1
+    
+    print("✓ fetch_page_with_retry tests passed")
+
+
+def test_check_page_exists_fails_fast():
+    """Test that page probes are never retried, so a 5xx counts as no content at once."""
+    print("Testing check_page_exists...")
+    
+    adapter = sd.PROBE_SESSION.get_adapter(sd.FEED_URL_PREFIX + "v2?page=1")
+    assert adapter.max_retries.total == 0
+    
+    with patch.object(sd.PROBE_SESSION, "get", return_value=Mock(status_code=503)) as get:
+        assert sd.check_page_exists(7, "token") is False
+    assert get.call_count == 1
+    
+    with patch.object(sd.PROBE_SESSION, "get", return_value=Mock(status_code=401)):
+        assert sd.check_page_exists(7, "token") is None
+    
+    page = Mock(status_code=200, content=b'{"clips": [{"id": "a"}]}')
+    with patch.object(sd.PROBE_SESSION, "get", return_value=page):
+        assert sd.check_page_exists(7, "token") == {"clips": [{"id": "a"}]}
+    
+    print("✓ check_page_exists tests passed")
+
+
+def test_download_ranges():
+    """Test ranged downloads: stitched ranges, fallback to one stream, and failed segments."""
+    print("Testing ranged downloads...")
+    
+    with tempfile.TemporaryDirectory() as tmpdir, audio_server() as (base_url, server), \
+         patch.object(sd, "RANGED_MIN_SIZE", 1024), patch.object(sd.time, "sleep"):
+        # 206 ranges are written at their offsets into one file
+        filename = os.path.join(tmpdir, "Ranged.mp3")
+        sd.download_file(base_url + "/ranges", filename)
+        with open(filename, "rb") as f:
+            assert f.read() == AUDIO
+        assert len([r for r in server.ranges if r]) == sd.RANGED_SEGMENTS - 1
+        assert not os.path.exists(filename + ".part")
+        
+        # A server answering a range with 200 falls back to a single stream
+        server.ranges.clear()
+        filename = os.path.join(tmpdir, "Ignored.mp3")
+        sd.download_file(base_url + "/ignore", filename)
+        with open(filename, "rb") as f:
+            assert f.read() == AUDIO
+        assert server.ranges[-1] is None
+        assert not os.path.exists(filename + ".part")
+        
+        # A failed segment leaves neither the part file nor the final file
+        filename = os.path.join(tmpdir, "Failed.mp3")
+        try:
+            sd.download_file(base_url + "/fail", filename)
+            assert False, "Should have raised exception"
+        except Exception:
+            pass
+        assert not os.path.exists(filename + ".part")
+        assert not os.path.exists(filename)
+    
+    print("✓ ranged download tests passed")
+
+
+def test_write_stream_leaves_no_partial_file():
+    """Test that a body or file copy failing midway leaves nothing under the final name."""
+    print("Testing write_stream failures...")
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "Song.mp3")
+        
+        # Connection closed before the whole body arrived
+        with audio_server() as (base_url, server), patch.object(sd.time, "sleep"):
+            try:
+                sd.download_file(base_url + "/truncated", filename)
+                assert False, "Should have raised exception"
+            except Exception:
+                pass
+        assert os.listdir(tmpdir) == []
+        
+        # Disk filling up while the buffered body is copied to disk
+        response = Mock()
+        response.raw = BytesIO(AUDIO)
+        real_copy = shutil.copyfileobj
+        
+        def copy_then_fail(src, dst, length=0):
+            if src is response.raw:
+                return real_copy(src, dst, length)
+            dst.write(src.read(100))
+            raise OSError(28, "No space left on device")
+        
+        with patch.object(sd.shutil, "copyfileobj", side_effect=copy_then_fail):
+            try:
+                sd.write_stream(response, filename)
+                assert False, "Should have raised exception"
+            except OSError:
+                pass
+        assert os.listdir(tmpdir) == []
+        
+        # Success swaps the complete file in
+        response.raw = BytesIO(AUDIO)
+        sd.write_stream(response, filename)
+        assert os.listdir(tmpdir) == ["Song.mp3"]
+        with open(filename, "rb") as f:
+            assert f.read() == AUDIO
+    
+    print("✓ write_stream failure tests passed")
+
+
+def test_download_all_pages_dedupes():
+    """Test that pages are combined oldest first, with one entry per UUID and incomplete clips dropped."""
+    print("Testing download_all_pages_parallel...")
+    
+    def clip(uuid, **fields):
+        return dict({"id": uuid, "title": uuid.upper(), "audio_url": f"http://example.com/{uuid}.mp3"}, **fields)
+    
+    # Newest first, as the API returns them; "dup" moved to page 2 while page 1 was fetched
+    pages = {
+        1: [clip("n1"), clip("n2"), clip("dup")],
+        2: [clip("dup"), clip("o1"), clip("untitled", title=None), clip("silent", audio_url=""), {"title": "No id"}],
+    }
+    
+    with patch.object(sd, "fetch_page_with_retry", side_effect=lambda page, *args: pages[page]):
+        songs = sd.download_all_pages_parallel(2, "token", max_workers=2)
+    
+    assert [song["uuid"] for song in songs] == ["o1", "dup", "n2", "n1"]
+    assert songs[0]["title"] == "O1"
+    
+    print("✓ download_all_pages_parallel tests passed")
+
+
 def test_create_placeholder_file():
     """Test placeholder file creation."""
     print("Testing placeholder file creation...")
@@ -181,6 +608,133 @@ def test_process_song_with_resume():
     print("✓ process_song with resume tests passed")
 
 
+def test_process_song_cover_failure():
+    """Test that a failing thumbnail still saves the song, just without cover art."""
+    print("Testing process_song with a failing cover...")
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        args = Mock()
+        args.directory = tmpdir
+        args.resume = True
+        args.with_thumbnail = True
+        args.token = "test_token"
+        
+        song_data = {
+            "uuid": "uuid456",
+            "title": "Coverless",
+            "audio_url": "http://example.com/song.mp3",
+            "image_url": "http://example.com/missing.jpg",
+            "display_name": "Artist"
+        }
+        
+        written_frames = []
+        
+        def fake_download(url, filename, tag_frames=None, **kwargs):
+            written_frames.extend(tag_frames())
+            return filename
+        
+        with patch.object(sd, "fetch_cover", side_effect=Exception("404 Not Found")), \
+             patch.object(sd, "download_file", side_effect=fake_download) as download:
+            uuid, filename, success, error, was_skipped = sd.process_song(
+                song_data, args, {}, set(), None
+            )
+        
+        assert success is True
+        assert filename == os.path.join(tmpdir, "Coverless.mp3")
+        assert download.call_count == 1
+        assert [frame.FrameID for frame in written_frames] == ["TIT2", "TPE1"]
+    
+    print("✓ process_song cover failure tests passed")
+
+
+def test_download_songs_interrupt():
+    """Test that Ctrl+C cancels queued songs but records the ones that finished."""
+    print("Testing download_songs interrupt...")
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        args = Mock()
+        args.directory = tmpdir
+        args.resume = False
+        args.max_workers = 2
+        
+        songs = [{"uuid": uuid, "title": uuid.upper()} for uuid in "abcd"]
+        started = {song["uuid"]: threading.Event() for song in songs}
+        release = threading.Event()
+        submitted = []
+        
+        def fake_extract(token, proxies_list, song_queue, token_container):
+            for song in songs:
+                song_queue.put(song)
+            return songs
+        
+        def fake_process(song_data, args, state, existing_files, proxies_list, target):
+            uuid = song_data["uuid"]
+            started[uuid].set()
+            if uuid in "bc":
+                release.wait(5)  # Still running when Ctrl+C arrives
+            success = uuid != "c"
+            return (uuid, target[0], success, None if success else "failed", False)
+        
+        class RecordingExecutor(sd.ThreadPoolExecutor):
+            def submit(self, *args, **kwargs):
+                future = super().submit(*args, **kwargs)
+                submitted.append(future)
+                return future
+            
+            def shutdown(self, *args, **kwargs):
+                release.set()  # Songs in flight finish only after the queued one was cancelled
+                super().shutdown(*args, **kwargs)
+        
+        def interrupted(futures):
+            started["c"].wait(5)  # "a" finished and freed its worker for "c"
+            raise KeyboardInterrupt
+            yield
+        
+        state = {}
+        with patch.object(sd, "extract_private_song_info", side_effect=fake_extract), \
+             patch.object(sd, "process_song", side_effect=fake_process), \
+             patch.object(sd, "ThreadPoolExecutor", RecordingExecutor), \
+             patch.object(sd, "as_completed", side_effect=interrupted):
+            try:
+                sd.download_songs(args, state, set(), {}, None, ["token"])
+                assert False, "Should have raised KeyboardInterrupt"
+            except KeyboardInterrupt:
+                pass
+        
+        assert submitted[3].cancelled()
+        assert not started["d"].is_set()
+        assert state == {
+            "a": os.path.join(tmpdir, "A.mp3"),
+            "b": os.path.join(tmpdir, "B.mp3")
+        }
+    
+    print("✓ download_songs interrupt tests passed")
+
+
+def test_split_downloaded():
+    """Test that songs recorded in state are filtered out before downloading."""
+    print("Testing split_downloaded...")
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        existing_file = os.path.join(tmpdir, "done.mp3")
+        with open(existing_file, 'w') as f:
+            f.write("dummy")
+        
+        state = {
+            "done": existing_file,
+            "deleted": os.path.join(tmpdir, "deleted.mp3")
+        }
+        songs = [{"uuid": "done"}, {"uuid": "deleted"}, {"uuid": "new"}]
+        
+        pending, skipped = sd.split_downloaded(songs, state)
+        
+        # Songs whose file went missing are downloaded again
+        assert [song["uuid"] for song in pending] == ["deleted", "new"]
+        assert skipped == 1
+    
+    print("✓ split_downloaded tests passed")
+
+
 def run_all_tests():
     """Run all tests."""
     print("=" * 60)
@@ -190,10 +744,24 @@ def run_all_tests():
     try:
         test_sanitize_filename()
         test_get_next_version_filename()
+        test_assign_filenames()
         test_state_management()
         test_retry_decorator()
+        test_backoff()
+        test_total_pages_hint()
+        test_read_leading_id3()
+        test_tags_saved_as_v23()
+        test_fetch_cover_single_flight()
+        test_fetch_page_retries_body()
+        test_check_page_exists_fails_fast()
+        test_download_all_pages_dedupes()
+        test_download_ranges()
+        test_write_stream_leaves_no_partial_file()
         test_create_placeholder_file()
         test_process_song_with_resume()
+        test_process_song_cover_failure()
+        test_split_downloaded()
+        test_download_songs_interrupt()
         
         print("\n" + "=" * 60)
         print("✓ All tests passed!")